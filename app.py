@@ -17,11 +17,20 @@ if "OPENAI_API_KEY" not in os.environ:
         pass
 
 # Now safe to import generator which uses os.getenv("OPENAI_API_KEY")
-from generator import generate_questions_from_text
+from generator import stream_questions_from_text
 from exporter import questions_to_dataframe, df_to_csv_bytes, questions_to_json_bytes
 
 # Standard libs for file handling
-from io import BytesIO
+from io import BytesIO, StringIO
+import functools
+import gc
+import hashlib
+import html
+import json
+import posixpath
+import re
+import time
+import zipfile
 
 st.set_page_config(page_title="AI Quiz Generator", layout="wide")
 
@@ -29,56 +38,163 @@ st.set_page_config(page_title="AI Quiz Generator", layout="wide")
 # ---------------------------
 # File parsing helpers (lazy import heavy libs)
 # ---------------------------
-def extract_text_from_pdf(uploaded_file) -> str:
+@functools.lru_cache(maxsize=None)
+def _pdfplumber():
     """
-    Extract text from uploaded PDF file. Uses pdfplumber if available.
+    Import pdfplumber on first use only (pdfminer makes it slow to import).
+    """
+    import pdfplumber
+    return pdfplumber
+
+
+@functools.lru_cache(maxsize=None)
+def _etree():
+    """
+    XML parser for PPTX slides, imported on first use: lxml if available, else the stdlib one.
+    """
+    try:
+        from lxml import etree
+    except Exception:
+        import xml.etree.ElementTree as etree
+    return etree
+
+
+@functools.lru_cache(maxsize=None)
+def _xml_parser():
+    """
+    Hardened lxml parser for untrusted uploads: no entity resolution (XXE) and no network access.
+    The stdlib parser never fetches external entities, so it needs no custom parser (None).
+    """
+    etree = _etree()
+    if etree.__name__.startswith("lxml"):
+        return etree.XMLParser(resolve_entities=False, no_network=True)
+    return None
+
+
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60, max_entries=16)
+def extract_text_from_pdf(file_bytes: bytes) -> str:
+    """
+    Extract text from uploaded PDF bytes. Uses pdfplumber if available.
     Falls back to an empty string and error message if pdfplumber not installed.
+    Cached on the file bytes so reruns don't re-parse the same upload.
     """
-    uploaded_file.seek(0)
     try:
-        import pdfplumber
+        pdfplumber = _pdfplumber()
     except Exception:
         st.error("PDF parsing requires `pdfplumber` installed. Ask the maintainer to add it.")
         return ""
 
-    text_parts = []
+    buf = StringIO()
     try:
-        with pdfplumber.open(uploaded_file) as pdf:
+        with pdfplumber.open(BytesIO(file_bytes)) as pdf:
             for p in pdf.pages:
                 t = p.extract_text()
                 if t:
-                    text_parts.append(t)
+                    buf.write(t)
+                    buf.write("\n")
+                # drop the page's parsed objects as we go to keep peak memory low
+                if hasattr(p, "flush_cache"):
+                    p.flush_cache()
     except Exception as e:
         st.error(f"Error parsing PDF: {e}")
         return ""
-    return "\n".join(text_parts)
+    finally:
+        gc.collect()
+    return buf.getvalue().rstrip("\n")
+
+
+_DRAWINGML_NS = {"a": "http://schemas.openxmlformats.org/drawingml/2006/main"}
+_PRESENTATION_NS = {
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "r": "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+}
+_RELS_NS = {"rel": "http://schemas.openxmlformats.org/package/2006/relationships"}
+_SLIDE_PART_RE = re.compile(r"ppt/slides/slide(\d+)\.xml")
+
+
+def _parse_xml(data: bytes):
+    """
+    Parse XML from an untrusted upload with the hardened parser from _xml_parser().
+    """
+    return _etree().fromstring(data, _xml_parser())
 
 
-def extract_text_from_pptx(uploaded_file) -> str:
+def _slide_part_names(z: zipfile.ZipFile) -> list:
     """
-    Extract text from uploaded PPTX file using python-pptx.
-    If the package is missing, show error and return empty string.
+    Slide part names in presentation order, following ppt/presentation.xml's sldIdLst
+    through its relationships (part numbers aren't renumbered when slides are reordered).
+    Falls back to part-number order if the deck's metadata is missing or malformed.
     """
-    uploaded_file.seek(0)
+    names = set(z.namelist())
     try:
-        from pptx import Presentation
+        pres = _parse_xml(z.read("ppt/presentation.xml"))
+        rels = _parse_xml(z.read("ppt/_rels/presentation.xml.rels"))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iterfind("rel:Relationship", _RELS_NS)}
+        rid_attr = "{%s}id" % _PRESENTATION_NS["r"]
+        ordered = []
+        for sld in pres.iterfind("p:sldIdLst/p:sldId", _PRESENTATION_NS):
+            target = targets.get(sld.get(rid_attr))
+            if not target:
+                continue
+            if target.startswith("/"):
+                name = target.lstrip("/")
+            else:
+                name = posixpath.normpath(posixpath.join("ppt", target))
+            if name in names:
+                ordered.append(name)
+        if ordered:
+            return ordered
     except Exception:
-        st.error("PPTX parsing requires `python-pptx` installed. Ask the maintainer to add it.")
-        return ""
+        pass
+    # slide2 before slide10
+    numbered = []
+    for name in names:
+        m = _SLIDE_PART_RE.fullmatch(name)
+        if m:
+            numbered.append((int(m.group(1)), name))
+    return [name for _, name in sorted(numbered)]
+
 
+@st.cache_data(show_spinner=False, ttl=24 * 60 * 60, max_entries=16)
+def extract_text_from_pptx(file_bytes: bytes) -> str:
+    """
+    Extract text from uploaded PPTX bytes by scanning the slide XML directly
+    (no python-pptx shape objects are built), in presentation order.
+    Uses lxml when available, with entity resolution and network access disabled.
+    Cached on the file bytes so reruns don't re-parse the same upload.
+    """
     parts = []
     try:
-        prs = Presentation(uploaded_file)
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text:
-                    parts.append(shape.text)
+        with zipfile.ZipFile(BytesIO(file_bytes)) as z:
+            for name in _slide_part_names(z):
+                root = _parse_xml(z.read(name))
+                for para in root.iterfind(".//a:p", _DRAWINGML_NS):
+                    line = "".join(t.text for t in para.iterfind(".//a:t", _DRAWINGML_NS) if t.text)
+                    if line:
+                        parts.append(line)
     except Exception as e:
         st.error(f"Error parsing PPTX: {e}")
         return ""
     return "\n".join(parts)
 
 
+# ---------------------------
+# Exports (cached per question set)
+# ---------------------------
+@st.cache_data(show_spinner=False, max_entries=32)
+def _derive_exports(questions_key: str, _questions: list):
+    """
+    Build the preview DataFrame plus CSV/JSON download bytes once per question set,
+    instead of on every rerun. `questions_key` identifies the set (see _questions_key).
+    """
+    df = questions_to_dataframe(_questions)
+    return df, df_to_csv_bytes(df), questions_to_json_bytes(_questions)
+
+
+def _questions_key(qs: list) -> str:
+    return hashlib.sha1(json.dumps(qs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 # ---------------------------
 # UI
 # ---------------------------
@@ -95,9 +211,9 @@ with st.sidebar:
         source_text = ""
         if uploaded is not None:
             if input_mode == "Upload PDF":
-                source_text = extract_text_from_pdf(uploaded)
+                source_text = extract_text_from_pdf(uploaded.getvalue())
             else:
-                source_text = extract_text_from_pptx(uploaded)
+                source_text = extract_text_from_pptx(uploaded.getvalue())
 
     qtype = st.selectbox("Question type", ["mcq", "tf", "full", "mixed"])
     n_questions = st.slider("Number of questions", 1, 30, 5)
@@ -115,6 +231,12 @@ if "timer_running" not in st.session_state:
     st.session_state.timer_running = False
 if "timer_end" not in st.session_state:
     st.session_state.timer_end = None
+if "questions_key" not in st.session_state:
+    st.session_state.questions_key = None
+if "last_fp" not in st.session_state:
+    st.session_state.last_fp = None
+if "timer_expired" not in st.session_state:
+    st.session_state.timer_expired = False
 
 # ---------------------------
 # Generate button action
@@ -123,34 +245,110 @@ if generate_btn:
     if not source_text or len(source_text.strip()) < 40:
         st.error("Please provide source text (paste or upload a file) with enough content.")
     else:
-        with st.spinner("Generating questions..."):
-            try:
-                qs = generate_questions_from_text(source_text, qtype, n_questions, difficulty)
-                # normalize ids
-                for i, q in enumerate(qs, start=1):
-                    q.setdefault("id", i)
-                st.session_state.questions = qs
-                st.success(f"Generated {len(qs)} questions.")
-                # start timer if requested
-                if use_timer:
-                    import time
-                    st.session_state.timer_end = time.time() + (timer_minutes * 60)
-                    st.session_state.timer_running = True
-            except Exception as e:
-                st.error(f"Generation failed: {e}")
+        fp = hashlib.blake2b(
+            f"{qtype}|{n_questions}|{difficulty}|".encode("utf-8") + source_text.encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+        if st.session_state.last_fp == fp and st.session_state.questions:
+            # same inputs as the questions already on screen: keep them, skip the LLM call
+            st.success(f"Reusing the {len(st.session_state.questions)} questions already generated for these inputs.")
+            if use_timer:
+                st.session_state.timer_end = time.time() + (timer_minutes * 60)
+                st.session_state.timer_running = True
+                st.session_state.timer_expired = False
+        else:
+            with st.spinner("Generating questions..."):
+                try:
+                    # show each question as soon as it arrives instead of waiting for the whole response
+                    live = st.empty()
+                    qs = []
+                    for q in stream_questions_from_text(source_text, qtype, n_questions, difficulty):
+                        qs.append(q)
+                        live.markdown("\n\n".join(f"**{x['id']}.** {x.get('question', '')}" for x in qs))
+                    live.empty()
+                    if not qs:
+                        # keep the current quiz rather than replacing it with nothing
+                        raise RuntimeError("the model response contained no questions. Please try again.")
+                    st.session_state.questions = qs
+                    st.session_state.questions_key = _questions_key(qs)
+                    st.session_state.last_fp = fp
+                    st.success(f"Generated {len(qs)} questions.")
+                    # start timer if requested
+                    if use_timer:
+                        st.session_state.timer_end = time.time() + (timer_minutes * 60)
+                        st.session_state.timer_running = True
+                        st.session_state.timer_expired = False
+                except Exception as e:
+                    st.error(f"Generation failed: {e}")
 
 # Timer display & logic (sidebar)
-if use_timer and st.session_state.get("timer_running") and st.session_state.get("timer_end"):
-    import time
+# Only the countdown re-renders each second; the rest of the script is not re-run.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+
+def _render_timer():
+    if not st.session_state.get("timer_running") or not st.session_state.get("timer_end"):
+        return
     remaining = int(st.session_state.timer_end - time.time())
     if remaining <= 0:
         st.session_state.timer_running = False
-        st.success("Time's up! You can now reveal answers.")
+        st.session_state.timer_expired = True
+        # one full rerun so the answers become available
+        st.rerun()
     else:
         mins, secs = divmod(remaining, 60)
-        st.sidebar.info(f"Time remaining: {mins:02d}:{secs:02d}")
-        # lightweight refresh to update timer
-        st.experimental_rerun()
+        st.info(f"Time remaining: {mins:02d}:{secs:02d}")
+
+
+def _render_timer_client_side():
+    """
+    Fallback for Streamlit versions without fragments: count down in the browser
+    so no server reruns are needed. The "Reveal answers" button triggers the one
+    rerun that unlocks the answers once time is up.
+    """
+    import streamlit.components.v1 as components
+    remaining = int(st.session_state.timer_end - time.time())
+    if remaining <= 0:
+        st.session_state.timer_running = False
+        st.session_state.timer_expired = True
+        return
+    components.html(
+        f"""
+        <div id="quiz-timer" style="font-family: sans-serif; padding: 0.5rem 0;"></div>
+        <script>
+        const end = Date.now() + {remaining} * 1000;
+        const el = document.getElementById("quiz-timer");
+        function tick() {{
+            const left = Math.max(0, Math.round((end - Date.now()) / 1000));
+            if (left === 0) {{
+                el.textContent = "Time's up! Click 'Reveal answers' below.";
+                clearInterval(handle);
+                return;
+            }}
+            const m = String(Math.floor(left / 60)).padStart(2, "0");
+            const s = String(left % 60).padStart(2, "0");
+            el.textContent = "Time remaining: " + m + ":" + s;
+        }}
+        const handle = setInterval(tick, 1000);
+        tick();
+        </script>
+        """,
+        height=50,
+    )
+    if st.button("Reveal answers", key="reveal_answers"):
+        # this click already reran the script with time still left
+        st.caption("Answers unlock when the timer reaches 00:00.")
+
+
+if use_timer and st.session_state.get("timer_running") and st.session_state.get("timer_end"):
+    with st.sidebar:
+        if _fragment is not None:
+            _fragment(run_every=1.0)(_render_timer)()
+        else:
+            _render_timer_client_side()
+
+if use_timer and st.session_state.get("timer_expired"):
+    st.sidebar.success("Time's up! You can now reveal answers.")
 
 # ---------------------------
 # Main UI layout
@@ -173,19 +371,21 @@ with cols[0]:
                         for idx, o in enumerate(opts):
                             st.write(f"{chr(65+idx)}. {o}")
                 if not use_timer or (use_timer and not st.session_state.get("timer_running")):
-                    if st.button(f"Show Answer for Q{qid}", key=f"show_{qid}"):
-                        st.markdown(f"**Answer:** {q.get('answer')}")
-                        if q.get("explanation"):
-                            st.markdown(f"**Explanation:** {q.get('explanation')}")
+                    # toggled in the browser by <details>, so revealing an answer doesn't rerun the script
+                    answer_md = f"**Answer:** {html.escape(str(q.get('answer')))}"
+                    if q.get("explanation"):
+                        answer_md += f"\n\n**Explanation:** {html.escape(str(q.get('explanation')))}"
+                    st.markdown(
+                        f"<details><summary>Show Answer</summary>\n\n{answer_md}\n\n</details>",
+                        unsafe_allow_html=True,
+                    )
                 else:
                     st.info("Answers are hidden while the timer is running.")
 
 with cols[1]:
     st.header("Actions")
     if st.session_state.questions:
-        df = questions_to_dataframe(st.session_state.questions)
-        csv_bytes = df_to_csv_bytes(df)
-        json_bytes = questions_to_json_bytes(st.session_state.questions)
+        df, csv_bytes, json_bytes = _derive_exports(st.session_state.questions_key, st.session_state.questions)
         st.download_button("Download CSV", data=csv_bytes, file_name="questions.csv", mime="text/csv")
         st.download_button("Download JSON", data=json_bytes, file_name="questions.json", mime="application/json")
         st.markdown("---")
@@ -193,6 +393,7 @@ with cols[1]:
         st.dataframe(df)
         if st.button("Clear questions"):
             st.session_state.questions = []
+            st.session_state.questions_key = None
             st.experimental_rerun()
     else:
         st.write("No actions available yet.")
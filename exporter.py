@@ -1,5 +1,4 @@
 # exporter.py
-from io import BytesIO
 import pandas as pd
 from typing import List, Dict, Any
 import json
@@ -9,28 +8,33 @@ def questions_to_dataframe(qs: List[Dict[str, Any]]) -> pd.DataFrame:
     Convert list of question dicts into a pandas DataFrame.
     Options (list) are joined into a single string with '|' as separator.
     """
-    rows = []
+    ids, types, questions, options, answers, explanations, difficulties = [], [], [], [], [], [], []
     for q in qs:
-        row = {
-            "id": q.get("id"),
-            "type": q.get("type"),
-            "question": q.get("question"),
-            "options": "|".join(q.get("options")) if q.get("options") else None,
-            "answer": q.get("answer"),
-            "explanation": q.get("explanation"),
-            "difficulty": q.get("difficulty"),
-        }
-        rows.append(row)
-    return pd.DataFrame(rows)
+        ids.append(q.get("id"))
+        types.append(q.get("type"))
+        questions.append(q.get("question"))
+        opts = q.get("options")
+        options.append("|".join(opts) if opts else None)
+        answers.append(q.get("answer"))
+        explanations.append(q.get("explanation"))
+        difficulties.append(q.get("difficulty"))
+    # build column-wise: avoids per-row dicts and pandas' row inference
+    return pd.DataFrame({
+        "id": ids,
+        "type": types,
+        "question": questions,
+        "options": options,
+        "answer": answers,
+        "explanation": explanations,
+        "difficulty": difficulties,
+    })
 
 def df_to_csv_bytes(df: pd.DataFrame) -> bytes:
     """
     Convert DataFrame to CSV bytes for Streamlit download button.
     """
-    buf = BytesIO()
-    df.to_csv(buf, index=False)
-    buf.seek(0)
-    return buf.read()
+    # to_csv with no target returns the str directly; encode once instead of a BytesIO round-trip
+    return df.to_csv(index=False).encode("utf-8")
 
 def questions_to_json_bytes(qs: List[Dict[str, Any]]) -> bytes:
     """
@@ -4,26 +4,107 @@
 import os
 import json
 import re
+import functools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-import openai
+from openai import OpenAI
 
 # choose model by env var or default
 MODEL_NAME = os.environ.get("MODEL_NAME", "gpt-4o-mini")  # change if you want another model
-openai.api_key = os.getenv("OPENAI_API_KEY")
-if not openai.api_key:
+# the client reads OPENAI_API_KEY itself; fail early with a clear message if it's missing
+if not os.getenv("OPENAI_API_KEY"):
     raise RuntimeError("Set OPENAI_API_KEY in a .env file or environment variable.")
 
 BASE_PROMPTS_DIR = Path(__file__).parent / "prompts"
 
+_JSON_DECODER = json.JSONDecoder()
 
+# patterns used when pulling JSON out of free-form model text
+_ARRAY_START_RE = re.compile(r'\[')
+_OBJ_START_RE = re.compile(r'\{')
+_COMMA_SEP_RE = re.compile(r'\s*,\s*')
+_ARRAY_RE = re.compile(r'(\[.*\])', re.S)
+_OBJ_RE = re.compile(r'(\{.*\})', re.S)
+_TRAILING_COMMA_RE = re.compile(r',\s*([\]\}])')
+_ELEMENT_SEP_RE = re.compile(r'[\s,]*')
+_STREAM_ARRAY_START_RE = re.compile(r'\s*(?:\{\s*"[^"]*"\s*:\s*)?\[')
+
+SYSTEM_PROMPT = (
+    "You are an assistant that outputs clean JSON and nothing else. "
+    'Respond with a JSON object of the form {"questions": [...]} where the array holds the requested questions.'
+)
+
+# raw model responses, keyed on (prompt, model, max_tokens, temperature); shared by the
+# streaming and non-streaming paths
+LLM_CACHE_SIZE = 128
+_LLM_CACHE: OrderedDict = OrderedDict()
+_LLM_CACHE_LOCK = threading.Lock()
+
+# source text beyond this many tokens is truncated before prompting
+MAX_CTX_TOKENS = int(os.environ.get("MAX_CTX_TOKENS", 8000))
+
+# large requests are split into batches of this many questions, generated concurrently
+SHARD_SIZE = 5
+MAX_CONCURRENT_REQUESTS = 4
+
+
+@functools.lru_cache(maxsize=16)
 def _read_prompt_file(name: str) -> str | None:
+    """
+    Read a prompt template from prompts/. Cached so templates are read once per process.
+    """
     p = BASE_PROMPTS_DIR / name
     if p.exists():
         return p.read_text(encoding="utf-8")
     return None
 
 
+@functools.lru_cache(maxsize=1)
+def _get_client():
+    """
+    Shared OpenAI client, so its HTTP connection pool is reused across calls and reruns.
+    """
+    return OpenAI()
+
+
+@functools.lru_cache(maxsize=4)
+def _get_encoding(model: str):
+    """
+    tiktoken encoding for the model, or None if tiktoken isn't installed or its
+    BPE file can't be loaded (e.g. no network to download it).
+    """
+    try:
+        import tiktoken
+    except Exception:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def _truncate_to_token_budget(text: str, model: str, max_tokens: int = MAX_CTX_TOKENS) -> str:
+    """
+    Cut the source text to at most max_tokens tokens so prompt cost and latency stay bounded.
+    Without a usable tiktoken encoding, falls back to roughly 4 characters per token.
+    """
+    enc = _get_encoding(model)
+    if enc is None:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars]
+    # source text is plain data: special-token strings like <|endoftext|> are encoded as ordinary text
+    toks = enc.encode(text, disallowed_special=())
+    if len(toks) <= max_tokens:
+        return text
+    return enc.decode(toks[:max_tokens])
+
+
 # fallback prompt — structured output as JSON array
 FALLBACK_PROMPTS = {
     "mcq": (
@@ -46,77 +127,97 @@ FALLBACK_PROMPTS = {
         "id (int, optional), type ('full'), question (string), answer (string), explanation (optional), difficulty.\n\n"
         "Source text:\n```{source_text}```\n\nReturn the JSON array only."
     ),
+    "mixed": (
+        "You are an exam creator. Given the following source text delimited by triple backticks, create "
+        "{mcq_n} multiple-choice, {tf_n} True/False and {full_n} short-answer questions. RETURN ONLY ONE JSON ARRAY "
+        "containing all of them. Each object has keys: id (int, optional), type ('mcq', 'tf' or 'full'), "
+        "question (string), answer, explanation (optional), difficulty. MCQs also have options (list of 4 strings) "
+        "and answer one of 'A','B','C','D'; True/False answers are true/false.\n\n"
+        "Source text:\n```{source_text}```\n\nReturn the JSON array only."
+    ),
 }
 
 
+def _mixed_counts(n: int, start: int = 0) -> dict:
+    """
+    Split n questions across mcq/tf/full for the mixed prompt, round-robin by question index.
+    `start` is the index of the first question, so consecutive shards stay balanced overall.
+    """
+    counts = [len(range((t - start) % 3, n, 3)) for t in range(3)]
+    return {"mcq_n": counts[0], "tf_n": counts[1], "full_n": counts[2]}
+
+
+def _shard_sizes(n: int) -> list:
+    """
+    Split n into batches of at most SHARD_SIZE questions.
+    """
+    return [min(SHARD_SIZE, n - i) for i in range(0, n, SHARD_SIZE)]
+
+
+def _repair_json(s: str) -> str:
+    """
+    Quick repairs for common model JSON mistakes: smart quotes and trailing commas.
+    """
+    s2 = s.replace("“", '"').replace("”", '"').replace("’", "'")
+    # remove trailing commas before closing brackets/braces
+    return _TRAILING_COMMA_RE.sub(r'\1', s2)
+
+
+def _is_object_list(value) -> bool:
+    return isinstance(value, list) and bool(value) and all(isinstance(x, dict) for x in value)
+
+
 def _extract_json_from_text(text: str) -> str:
     """
     Try to extract the first JSON array or object from the text.
     If the model returned a string with commentary + JSON, we extract the JSON substring.
+    Bracket matching (including brackets inside strings) is left to json's C decoder.
     """
-    # common approach: find the first '[' and matching closing ']' OR first '{'...' }' if array not found
-    # but prefer top-level array
     text = text.strip()
-    # try to find first JSON array
-    array_start = text.find('[')
-    if array_start != -1:
-        # attempt to find matching bracket by counting
-        depth = 0
-        for i in range(array_start, len(text)):
-            if text[i] == '[':
-                depth += 1
-            elif text[i] == ']':
-                depth -= 1
-                if depth == 0:
-                    return text[array_start:i+1]
-    # fallback: try to find JSON object sequence like { ... } repeated
-    obj_start = text.find('{')
-    if obj_start != -1:
-        # try to find closing bracket for last top-level object sequence
-        depth = 0
-        for i in range(obj_start, len(text)):
-            if text[i] == '{':
-                depth += 1
-            elif text[i] == '}':
-                depth -= 1
-                if depth == 0:
-                    candidate = text[obj_start:i+1]
-                    # if there's a sequence of objects separated by commas, wrap in [ ... ]
-                    # quick heuristic: if after candidate there's a comma+{ then collect more
-                    j = i+1
-                    objs = [candidate]
-                    while True:
-                        # skip whitespace
-                        while j < len(text) and text[j].isspace():
-                            j += 1
-                        if j < len(text) and text[j] == ',':
-                            # find next object
-                            j += 1
-                            while j < len(text) and text[j].isspace():
-                                j += 1
-                            if j < len(text) and text[j] == '{':
-                                # find end of next object
-                                k = j
-                                depth2 = 0
-                                for k in range(j, len(text)):
-                                    if text[k] == '{':
-                                        depth2 += 1
-                                    elif text[k] == '}':
-                                        depth2 -= 1
-                                        if depth2 == 0:
-                                            objs.append(text[j:k+1])
-                                            j = k+1
-                                            break
-                                continue
-                        break
-                    if len(objs) > 1:
-                        return "[" + ",".join(objs) + "]"
-                    return candidate
+    # prefer a top-level array of objects: nested arrays such as a question's `options` are skipped
+    for m in _ARRAY_START_RE.finditer(text):
+        try:
+            value, end = _JSON_DECODER.raw_decode(text, m.start())
+        except ValueError:
+            # malformed (smart quotes, trailing commas): repair the span up to the last ']' and retry
+            last = text.rfind(']')
+            if last <= m.start():
+                continue
+            repaired = _repair_json(text[m.start():last + 1])
+            try:
+                value, end = _JSON_DECODER.raw_decode(repaired)
+            except ValueError:
+                continue
+            if _is_object_list(value):
+                return repaired[:end]
+            continue
+        if _is_object_list(value):
+            return text[m.start():end]
+    # fallback: first complete object, plus any comma-separated objects following it
+    for m in _OBJ_START_RE.finditer(text):
+        try:
+            _, end = _JSON_DECODER.raw_decode(text, m.start())
+        except ValueError:
+            continue
+        objs = [text[m.start():end]]
+        while True:
+            sep = _COMMA_SEP_RE.match(text, end)
+            if not sep or not text.startswith('{', sep.end()):
+                break
+            try:
+                _, next_end = _JSON_DECODER.raw_decode(text, sep.end())
+            except ValueError:
+                break
+            objs.append(text[sep.end():next_end])
+            end = next_end
+        if len(objs) > 1:
+            return "[" + ",".join(objs) + "]"
+        return objs[0]
     # last-resort: try regex to find {...} or [...]
-    m = re.search(r'(\[.*\])', text, flags=re.S)
+    m = _ARRAY_RE.search(text)
     if m:
         return m.group(1)
-    m2 = re.search(r'(\{.*\})', text, flags=re.S)
+    m2 = _OBJ_RE.search(text)
     if m2:
         return m2.group(1)
     # nothing found
@@ -130,10 +231,7 @@ def _safe_json_load(s: str):
     try:
         return json.loads(s)
     except Exception:
-        # quick repairs
-        s2 = s.replace("“", '"').replace("”", '"').replace("’", "'")
-        # remove trailing commas before closing brackets/braces
-        s2 = re.sub(r',\s*([\]\}])', r'\1', s2)
+        s2 = _repair_json(s)
         try:
             return json.loads(s2)
         except Exception:
@@ -200,40 +298,229 @@ def _normalize_questions(raw_list, requested_type: str) -> list:
     return out
 
 
-def generate_questions_from_text(source_text: str, qtype: str = "mcq", n: int = 5, difficulty: str = "medium") -> list:
+def _cache_get(key: tuple) -> str | None:
+    with _LLM_CACHE_LOCK:
+        text = _LLM_CACHE.get(key)
+        if text is not None:
+            _LLM_CACHE.move_to_end(key)
+        return text
+
+
+def _has_questions(items: list) -> bool:
     """
-    Main entrypoint used by app.py.
-    Returns a list of question dicts.
+    Whether parsed model output holds at least one question object (worth caching).
     """
-    # read a template if present
-    template_file = f"{qtype}_template.txt"
-    prompt_template = _read_prompt_file(template_file) or FALLBACK_PROMPTS.get(qtype, FALLBACK_PROMPTS["mcq"])
+    return any(isinstance(x, dict) and x.get("question") for x in items)
+
+
+def _cache_put(key: tuple, text: str) -> None:
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE[key] = text
+        _LLM_CACHE.move_to_end(key)
+        while len(_LLM_CACHE) > LLM_CACHE_SIZE:
+            _LLM_CACHE.popitem(last=False)
 
-    prompt = prompt_template.format(source_text=source_text, n=n, difficulty=difficulty)
 
-    # Call OpenAI ChatCompletion (or completions) - prefer chat API
+def _create_completion(prompt: str, model: str, max_tokens: int, temperature: float, stream: bool = False):
+    """
+    Issue the chat completion request (streaming or not).
+    JSON mode guarantees parseable output; models without it are retried without the flag.
+    """
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
     try:
-        resp = openai.ChatCompletion.create(
-            model=os.environ.get("MODEL_NAME", MODEL_NAME),
-            messages=[
-                {"role": "system", "content": "You are an assistant that outputs clean JSON and nothing else."},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=2000,
-            temperature=0.2,
-        )
+        try:
+            return _get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                response_format={"type": "json_object"},
+                stream=stream,
+            )
+        except Exception as e:
+            if "response_format" not in str(e):
+                raise
+            return _get_client().chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=stream,
+            )
     except Exception as e:
         raise RuntimeError(f"LLM request failed: {e}")
 
+
+def _call_llm_cached(prompt: str, model: str, max_tokens: int, temperature: float) -> str:
+    """
+    Send the prompt to the chat API and return the raw model text.
+    Memoized per process so identical prompts don't hit the API again; only complete responses with questions are cached.
+    """
+    key = (prompt, model, max_tokens, temperature)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    resp = _create_completion(prompt, model, max_tokens, temperature)
+
     # extract text
     try:
-        llm_text = resp["choices"][0]["message"]["content"]
-    except Exception:
-        # fallback for older OpenAI libs or other shapes
+        llm_text = resp.choices[0].message.content
+    except Exception as e:
+        raise RuntimeError(f"Could not read model response: {e}")
+    if not llm_text:
+        raise RuntimeError("Model returned an empty response.")
+
+    # only cache complete output that yields questions, so a truncated response or refusal isn't replayed on retry
+    finish_reason = getattr(resp.choices[0], "finish_reason", None)
+    if finish_reason != "length" and _has_questions(_parse_llm_questions(llm_text)):
+        _cache_put(key, llm_text)
+    return llm_text
+
+
+def _scan_stream_objects(buf: str, pos: int | None) -> tuple:
+    """
+    Pull the question objects that are complete so far out of a partially streamed response.
+    `pos` is where the next array element may start (None until the question array's '[' has arrived).
+    Returns (objects, new_pos).
+    """
+    objs = []
+    if pos is None:
+        # only a top-level array or the array value of the object's first key holds questions;
+        # anything else (a bare question object, prose) is left to the full parse at the end
+        m = _STREAM_ARRAY_START_RE.match(buf)
+        if not m:
+            return objs, None
+        pos = m.end()
+    while True:
+        sep = _ELEMENT_SEP_RE.match(buf, pos)
+        start = sep.end()
+        # wait until the next object has at least been closed once before trying to decode it
+        if not buf.startswith('{', start) or buf.find('}', start) == -1:
+            break
         try:
-            llm_text = resp["choices"][0]["text"]
-        except Exception as e:
-            raise RuntimeError(f"Could not read model response: {e}")
+            obj, end = _JSON_DECODER.raw_decode(buf, start)
+        except ValueError:
+            break
+        objs.append(obj)
+        pos = end
+    return objs, pos
+
+
+def _stream_llm_questions(prompt: str, model: str, max_tokens: int, temperature: float):
+    """
+    Stream the completion and yield each question object as soon as it has been fully received.
+    Falls back to parsing the whole text at the end if the incremental scan didn't reach the end of the array.
+    """
+    key = (prompt, model, max_tokens, temperature)
+    cached = _cache_get(key)
+    if cached is not None:
+        yield from _parse_llm_questions(cached)
+        return
+
+    resp = _create_completion(prompt, model, max_tokens, temperature, stream=True)
+    buf, pos, yielded, finish_reason = "", None, 0, None
+    try:
+        for chunk in resp:
+            if not chunk.choices:
+                continue
+            finish_reason = getattr(chunk.choices[0], "finish_reason", None) or finish_reason
+            delta = chunk.choices[0].delta.content or ""
+            if not delta:
+                continue
+            buf += delta
+            objs, pos = _scan_stream_objects(buf, pos)
+            for obj in objs:
+                yielded += 1
+                yield obj
+    except Exception as e:
+        raise RuntimeError(f"LLM request failed: {e}")
+
+    complete = pos is not None and buf.startswith(']', _ELEMENT_SEP_RE.match(buf, pos).end())
+    if not complete:
+        # the scanner stopped before the array's closing ']': either an element it couldn't decode
+        # (smart quotes, trailing comma) or a cut-off response. Run the full repair parse and emit
+        # whatever wasn't yielded yet.
+        try:
+            items = [x for x in _parse_llm_questions(buf) if isinstance(x, dict)]
+        except RuntimeError:
+            if not yielded:
+                raise
+            # truncated beyond repair: keep what was already streamed, but don't cache it
+            return
+        for obj in items[yielded:]:
+            yielded += 1
+            yield obj
+        # cacheable only if the whole response loads (after repairs), i.e. it wasn't cut off
+        try:
+            _safe_json_load(buf.strip())
+            complete = _has_questions(items)
+        except ValueError:
+            complete = False
+    # only cache complete output, so a cut-off response isn't replayed on the next identical request
+    if complete and yielded and finish_reason != "length":
+        _cache_put(key, buf)
+
+
+def _build_prompt(source_text: str, qtype: str, n: int, difficulty: str, start: int = 0, shard: tuple = (1, 1)) -> str:
+    """
+    Fill the prompt template for one batch of n questions.
+    `shard` is (batch number, batch count); with more than one batch the model is told to vary its questions.
+    """
+    # read a template if present
+    template_file = f"{qtype}_template.txt"
+    prompt_template = _read_prompt_file(template_file) or FALLBACK_PROMPTS.get(qtype, FALLBACK_PROMPTS["mcq"])
+
+    # mixed asks for all three types in a single call instead of one call per type
+    counts = _mixed_counts(n, start) if qtype == "mixed" else {}
+    prompt = prompt_template.format(source_text=source_text, n=n, difficulty=difficulty, **counts)
+    part, total = shard
+    if total > 1:
+        prompt += (
+            f"\n\nThis is batch {part} of {total} for the same quiz. Focus mainly on part {part} of {total} "
+            "of the source text so the batches don't repeat each other's questions."
+        )
+    return prompt
+
+
+def _questions_from_object(parsed):
+    """
+    Pull the question list out of a JSON-mode object, or None if it doesn't look like one.
+    Accepts {"questions": [...]}, the same array under any other single list-of-objects key,
+    or a bare question object (common for n=1).
+    """
+    if not isinstance(parsed, dict):
+        return None
+    if isinstance(parsed.get("questions"), list):
+        return parsed["questions"]
+    if "question" in parsed:
+        return [parsed]
+    lists = [v for v in parsed.values() if isinstance(v, list)]
+    if len(lists) == 1 and lists[0] and all(isinstance(x, dict) for x in lists[0]):
+        return lists[0]
+    return None
+
+
+def _parse_llm_questions(llm_text: str) -> list:
+    """
+    Parse the question array from raw model text.
+    JSON mode output (see _questions_from_object) is loaded directly; anything else goes through the extraction/repair path.
+    """
+    if not llm_text:
+        raise RuntimeError("Model returned an empty response.")
+    try:
+        # whole response, with the smart-quote/trailing-comma repairs if plain loading fails
+        parsed = _safe_json_load(llm_text.strip())
+    except (TypeError, ValueError):
+        parsed = None
+    if isinstance(parsed, list):
+        return parsed
+    questions = _questions_from_object(parsed)
+    if questions is not None:
+        return questions
 
     # Extract likely JSON
     json_text = _extract_json_from_text(llm_text)
@@ -248,9 +535,83 @@ def generate_questions_from_text(source_text: str, qtype: str = "mcq", n: int =
         parsed = [parsed]
     if not isinstance(parsed, list):
         raise RuntimeError("Model output was not a JSON array of questions.")
+    return parsed
+
+
+def _build_prompts(source_text: str, qtype: str, n: int, difficulty: str, model: str) -> list:
+    """
+    Truncate the source text and build one prompt per batch of at most SHARD_SIZE questions.
+    """
+    # truncate once up front; every batch reuses the same bounded text
+    source_text = _truncate_to_token_budget(source_text, model)
+    sizes = _shard_sizes(n)
+    starts = [sum(sizes[:i]) for i in range(len(sizes))]
+    return [
+        _build_prompt(source_text, qtype, k, difficulty, start=first, shard=(i + 1, len(sizes)))
+        for i, (k, first) in enumerate(zip(sizes, starts))
+    ]
+
+
+def generate_questions_from_text(source_text: str, qtype: str = "mcq", n: int = 5, difficulty: str = "medium") -> list:
+    """
+    Non-streaming entrypoint: returns the full list of question dicts at once
+    (app.py uses stream_questions_from_text).
+    Requests for more than SHARD_SIZE questions are split into smaller batches sent concurrently.
+    """
+    model = os.environ.get("MODEL_NAME", MODEL_NAME)
+    prompts = _build_prompts(source_text, qtype, n, difficulty, model)
+
+    if len(prompts) == 1:
+        texts = [_call_llm_cached(prompts[0], model, 2000, 0.2)]
+    else:
+        # the chat call is blocking network IO, so threads give real concurrency here
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(prompts))) as pool:
+            texts = list(pool.map(lambda p: _call_llm_cached(p, model, 2000, 0.2), prompts))
+
+    parsed = []
+    for llm_text in texts:
+        parsed.extend(_parse_llm_questions(llm_text))
+    if len(texts) > 1:
+        # each batch numbers its questions from 1; drop those ids so the merged list is renumbered
+        for item in parsed:
+            if isinstance(item, dict):
+                item.pop("id", None)
 
     # Normalize and ensure ids
     questions = _normalize_questions(parsed, requested_type=qtype)
 
     # If the model returned fewer items than requested, that's okay — return what we have
     return questions
+
+
+def stream_questions_from_text(source_text: str, qtype: str = "mcq", n: int = 5, difficulty: str = "medium"):
+    """
+    Streaming variant of generate_questions_from_text: yields normalized question dicts
+    (with sequential ids) as soon as each one is available, so the UI can show them early.
+    A single batch is streamed token by token; multiple batches are yielded as each one finishes.
+    """
+    model = os.environ.get("MODEL_NAME", MODEL_NAME)
+    prompts = _build_prompts(source_text, qtype, n, difficulty, model)
+
+    next_id = 1
+
+    def _emit(raw_items):
+        nonlocal next_id
+        for item in raw_items:
+            if not isinstance(item, dict):
+                continue
+            item = dict(item)
+            item.pop("id", None)
+            q = _normalize_questions([item], requested_type=qtype)[0]
+            q["id"] = next_id
+            next_id += 1
+            yield q
+
+    if len(prompts) == 1:
+        yield from _emit(_stream_llm_questions(prompts[0], model, 2000, 0.2))
+        return
+
+    with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REQUESTS, len(prompts))) as pool:
+        futures = [pool.submit(_call_llm_cached, p, model, 2000, 0.2) for p in prompts]
+        for fut in as_completed(futures):
+            yield from _emit(_parse_llm_questions(fut.result()))
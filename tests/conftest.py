@@ -0,0 +1,7 @@
+import os
+import sys
+from pathlib import Path
+
+# generator.py lives at the repo root and refuses to import without an API key
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
@@ -0,0 +1,146 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import generator
+
+
+class FakeCompletions:
+    """
+    Stands in for client.chat.completions: replies with the queued texts in order
+    (repeating the last one), either whole or split into small stream chunks.
+    """
+
+    def __init__(self, replies, finish_reason="stop", chunk_size=7):
+        self.replies = list(replies)
+        self.finish_reason = finish_reason
+        self.chunk_size = chunk_size
+        self.calls = 0
+
+    def create(self, **kwargs):
+        text = self.replies[min(self.calls, len(self.replies) - 1)]
+        self.calls += 1
+        if kwargs.get("stream"):
+            chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+            out = [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=c), finish_reason=None)])
+                for c in chunks
+            ]
+            out.append(
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=None), finish_reason=self.finish_reason)])
+            )
+            return iter(out)
+        message = SimpleNamespace(content=text)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=self.finish_reason)])
+
+
+@pytest.fixture(autouse=True)
+def _clear_llm_cache():
+    generator._LLM_CACHE.clear()
+    yield
+    generator._LLM_CACHE.clear()
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    def install(replies, **kwargs):
+        completions = FakeCompletions(replies, **kwargs)
+        client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        monkeypatch.setattr(generator, "_get_client", lambda: client)
+        return completions
+    return install
+
+
+def _questions_json(*names):
+    return json.dumps({"questions": [{"type": "tf", "question": n, "answer": True} for n in names]})
+
+
+def test_extract_repairs_malformed_outer_array_after_prose():
+    text = (
+        'Here are the questions:\n'
+        '[{"question":"a","options":["x","y","z","w"]},'
+        '{"question":"b","options":["x","y","z","w"]},]'
+    )
+    parsed = generator._parse_llm_questions(text)
+    assert [q["question"] for q in parsed] == ["a", "b"]
+
+
+def test_responses_without_questions_are_not_cached(fake_llm):
+    llm = fake_llm(['{"error": "cannot help with that"}', _questions_json("a")])
+    generator.generate_questions_from_text("x" * 50, "tf", 1)
+    qs = generator.generate_questions_from_text("x" * 50, "tf", 1)
+    assert [q["question"] for q in qs] == ["a"]
+    assert llm.calls == 2
+
+
+def test_length_truncated_responses_are_not_cached(fake_llm):
+    llm = fake_llm([_questions_json("a")], finish_reason="length")
+    generator.generate_questions_from_text("x" * 50, "tf", 1)
+    generator.generate_questions_from_text("x" * 50, "tf", 1)
+    assert llm.calls == 2
+
+
+def test_truncated_stream_keeps_streamed_questions_and_is_not_cached(fake_llm):
+    full = json.dumps({"questions": [
+        {"type": "tf", "question": "a", "answer": True},
+        {"type": "tf", "question": "b", "answer": False, "explanation": "cut off here"},
+    ]})
+    truncated = full[:full.index("cut off")]
+    llm = fake_llm([truncated, full], finish_reason="length")
+    first = list(generator.stream_questions_from_text("x" * 50, "tf", 2))
+    assert [q["question"] for q in first] == ["a"]
+    llm.finish_reason = "stop"
+    second = list(generator.stream_questions_from_text("x" * 50, "tf", 2))
+    assert [q["question"] for q in second] == ["a", "b"]
+    assert llm.calls == 2
+
+
+def test_cut_off_stream_without_length_finish_is_not_cached(fake_llm):
+    full = _questions_json("a", "b")
+    llm = fake_llm([full[:full.index('"b"')], full])
+    assert [q["question"] for q in generator.stream_questions_from_text("x" * 50, "tf", 2)] == ["a"]
+    assert [q["question"] for q in generator.stream_questions_from_text("x" * 50, "tf", 2)] == ["a", "b"]
+    assert llm.calls == 2
+
+
+def test_scan_stream_objects_yields_each_object_once_complete():
+    text = '{"questions": [{"question": "a ] }"}, {"question": "b"}]}'
+    seen, pos = [], None
+    for i in range(1, len(text) + 1):
+        objs, pos = generator._scan_stream_objects(text[:i], pos)
+        seen.extend(objs)
+    assert seen == [{"question": "a ] }"}, {"question": "b"}]
+
+
+def test_stream_yields_chunked_questions_with_sequential_ids(fake_llm):
+    fake_llm([_questions_json("a", "b", "c")], chunk_size=3)
+    qs = list(generator.stream_questions_from_text("x" * 50, "tf", 3))
+    assert [(q["id"], q["question"]) for q in qs] == [(1, "a"), (2, "b"), (3, "c")]
+
+
+def test_stream_recovers_elements_after_an_undecodable_one(fake_llm):
+    fake_llm(['{"questions": [{"question": "a"}, {"question": “b”}, {"question": "c"},]}'])
+    qs = list(generator.stream_questions_from_text("x" * 50, "tf", 3))
+    assert [q["question"] for q in qs] == ["a", "b", "c"]
+
+
+def test_bare_question_object_is_one_question(fake_llm):
+    bare = json.dumps({"id": 1, "type": "tf", "question": "Q?", "answer": True, "tags": ["x", "y"]})
+    assert [q["question"] for q in generator._parse_llm_questions(bare)] == ["Q?"]
+    fake_llm([bare])
+    assert [q["question"] for q in generator.stream_questions_from_text("x" * 50, "tf", 1)] == ["Q?"]
+
+
+def test_mixed_counts_stay_balanced_across_shards():
+    sizes = generator._shard_sizes(12)
+    assert sizes == [5, 5, 2]
+    totals = {"mcq_n": 0, "tf_n": 0, "full_n": 0}
+    start = 0
+    for k in sizes:
+        counts = generator._mixed_counts(k, start)
+        assert sum(counts.values()) == k
+        for name, v in counts.items():
+            totals[name] += v
+        start += k
+    assert totals == {"mcq_n": 4, "tf_n": 4, "full_n": 4}